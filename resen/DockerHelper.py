@@ -267,6 +267,15 @@ class DockerHelper():
 
         return info['SizeRw']+info['SizeRootFs']
 
+    def get_container_statuses(self, container_ids):
+        '''
+        Get the status of several containers with a single docker API call.
+        Returns a dict mapping container ID to status.
+        '''
+        containers = self.docker.containers.list(all=True, filters={'id':container_ids})
+
+        return {x.id:x.status for x in containers}
+
     def get_container_status(self, bucket):
         '''
         Get the status of a particular container.
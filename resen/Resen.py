@@ -29,25 +29,99 @@
 
 
 import os
+import sys
+import functools   # caching of per-process constants
+import posixpath   # container paths are always posix
 import cmd         # for command line interface
 import json        # used to store bucket manifests locally and for export
 import time        # used for waiting (time.sleep())
 import socket      # find available port
 import shutil
-import random      # used to generate tokens for jupyter server
+import atexit      # release the instance lock at interpreter exit
+import threading   # background core list refresh
+import secrets     # used to generate tokens for jupyter server
 import tarfile
 import tempfile
 import tempfile    # use this to get unique name for docker container
 import webbrowser  # use this to open web browser
+from contextlib import contextmanager  # used to batch config writes
+from concurrent.futures import ThreadPoolExecutor, as_completed  # parallel mount compression on export
 from pathlib import Path            # used to check whitelist paths
-from subprocess import Popen, PIPE  # used for selinux detection
+import subprocess  # used for selinux detection
 import platform   # NEEDED FOR WINDOWS QUICK FIX
 import requests
 
+try:
+    import orjson  # much faster JSON serialization, if available
+except ImportError:
+    orjson = None
+
 
 from .DockerHelper import DockerHelper
 
 
+# valid permissions for mounted storage
+_VALID_PERMS = frozenset({'r','ro','rw'})
+_READONLY_PERMS = frozenset({'r','ro'})
+
+
+def _trim(string,length):
+    return string if len(string) <= length else string[:length-3]+'...'
+
+
+@functools.lru_cache(maxsize=1)
+def _get_config_dir():
+    # environment variables cannot change under us, so resolve (and create)
+    # the config directory once per process
+    appname = 'resen'
+
+    confighome = os.environ.get('APPDATA')
+    if confighome is None:
+        confighome = os.environ.get('XDG_CONFIG_HOME', os.path.join(os.environ['HOME'],'.config'))
+    configpath = os.path.join(confighome, appname)
+
+    # TODO: add error checking
+    os.makedirs(configpath, exist_ok=True)
+
+    return configpath
+
+
+# file and directory names never worth including in an exported bucket
+_EXPORT_SKIP_NAMES = frozenset({'__pycache__','.DS_Store','.git'})
+
+
+def _export_filter(tarinfo):
+    # returning None for a directory prunes its entire subtree
+    name = os.path.basename(tarinfo.name)
+    if name in _EXPORT_SKIP_NAMES or name.endswith('.pyc'):
+        return None
+    return tarinfo
+
+
+@functools.lru_cache(maxsize=1)
+def _detect_selinux():
+    # the selinux mode cannot change while resen is running, so the
+    # getenforce subprocess runs at most once per process
+    # selinux only exists on linux - skip the probe on macOS/Windows
+    if not sys.platform.startswith('linux'):
+        return False
+
+    # the kernel exports the enforcement state directly - reading it is just
+    # open/read/close instead of fork+exec of the getenforce binary
+    try:
+        with open('/sys/fs/selinux/enforce','rb') as f:
+            return f.read(1) == b'1'
+    except OSError:
+        # /sys/fs/selinux not mounted - fall back to getenforce
+        pass
+
+    try:
+        r = subprocess.run(['/usr/sbin/getenforce'], capture_output=True, text=True, timeout=1)
+        return r.returncode == 0 and r.stdout.strip() == 'Enforcing'
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        return False
+
+
 class Resen():
     def __init__(self):
 
@@ -55,18 +129,37 @@ class Resen():
         self.resen_root_dir = self._get_config_dir()
         self.resen_home_dir = self._get_home_dir()
 
+        # config file with information on existing buckets
+        self._bucket_config_path = os.path.join(self.resen_root_dir,'buckets.json')
 
-        # set lock
+
+        # set lock - all lock state is initialized here so __unlock is safe
+        # to call whether or not __lock ever ran
+        self.__lockfile = os.path.join(self.resen_root_dir,'lock')
+        self.__lockfd = None
         self.__locked = False
         self.__lock()
+        # __del__ is unreliable for cleanup (GC ordering, interpreter
+        # shutdown), so release the lock at interpreter exit instead
+        atexit.register(self.__unlock)
 
         # initialize docker helper
         self.dockerhelper = DockerHelper()
 
+        # short-lived cache of container statuses: container_id -> (status, timestamp)
+        self._status_cache = dict()
+
+        # config transaction state - see _config_transaction
+        self._txn_depth = 0
+        self._txn_dirty = False
+
+        # time of the last full status refresh - see update_bucket_statuses
+        self._statuses_refreshed = 0.0
+
         # load configuration
         self.load_config()
         self.valid_cores = self.__get_valid_cores()
-        self.selinux = self.__detect_selinux()
+        self._valid_cores_by_version = {x['version']:x for x in self.valid_cores}
 
         # self.win_vbox_map = None       # resencmd sets this if user specifies windows docker toolbox
         self.win_vbox_map = self.__get_win_vbox_map()
@@ -75,47 +168,107 @@ class Resen():
         ### If so, can we move the white list to resencmd.py? The server shouldn't ever try to
         ### mount to an illegal location but the user might.
         self.storage_whitelist = ['/home/jovyan/mount']
+        self._whitelist_prefixes = [posixpath.normpath(x) for x in self.storage_whitelist]
 
 
     def load_config(self):
         '''
         Load config file that contains information on existing buckets.
         '''
-        # define config file name
-        bucket_config = os.path.join(self.resen_root_dir,'buckets.json')
+        bucket_config = self._bucket_config_path
 
         # TODO: handle exceptions due to file reading problems (incorrect file permissions)
         # TODO: update status of buckets to double check that status is the same as in bucket.json
         try:
             # check if buckets.json exists, if not, initialize empty dictionary
-            with open(bucket_config,'r') as f:
-                params = json.load(f)
+            # read the file as bytes in one call - avoids the incremental
+            # text-mode reads and codec layer of json.load on a file handle
+            data = Path(bucket_config).read_bytes()
+            if orjson is not None:
+                params = orjson.loads(data)
+            else:
+                params = json.loads(data)
         except FileNotFoundError:
             # if config file doesn't exist, initialize and empty list
             params = list()
 
         self.buckets = params
-        self.bucket_names = [x['name'] for x in self.buckets]
+        # index of bucket name -> position in self.buckets for O(1) lookups
+        self._bucket_index = {x['name']:i for i,x in enumerate(self.buckets)}
+        # local ports assigned across all buckets, for O(1) availability checks
+        self._assigned_ports = {y[0] for x in self.buckets for y in x['port']}
+        # hash of the config as last written to disk (None forces a write)
+        self._config_hash = None
+
+
+    @property
+    def bucket_names(self):
+        return list(self._bucket_index)
+
+
+    @property
+    def selinux(self):
+        # detected lazily - only add_storage needs it, so other commands skip
+        # the subprocess call entirely - and cached for the process lifetime
+        return _detect_selinux()
 
 
     def save_config(self):
         '''
         Save config file with information on existing buckets
         '''
-        # define config file name
-        bucket_config = os.path.join(self.resen_root_dir,'buckets.json')
+        # inside a transaction, just mark the config dirty - it is written
+        # once when the outermost transaction exits
+        if self._txn_depth > 0:
+            self._txn_dirty = True
+            return
+
+        bucket_config = self._bucket_config_path
         # TODO: handle exceptions due to file writing problems (no free disk space, incorrect file permissions)
-        with open(bucket_config,'w') as f:
-            json.dump(self.buckets,f)
+        # pre-encode and write in one call - much faster than the many
+        # small writes json.dump issues through the encoder
+        if orjson is not None:
+            data = orjson.dumps(self.buckets)
+        else:
+            # compact separators to match orjson output and shrink the file
+            data = json.dumps(self.buckets, separators=(',',':'), ensure_ascii=False).encode('utf-8')
+
+        # skip the write entirely if nothing has changed since the last save
+        config_hash = hash(data)
+        if config_hash == self._config_hash:
+            return
+
+        # write to a temporary file and rename so a crash mid-write can never
+        # leave a truncated buckets.json behind
+        tmp_config = bucket_config + '.tmp'
+        with open(tmp_config,'wb') as f:
+            f.write(data)
+        os.replace(tmp_config, bucket_config)
+        self._config_hash = config_hash
+
+
+    @contextmanager
+    def _config_transaction(self):
+        '''
+        Coalesce all save_config calls issued inside the block into a single
+        write performed when the outermost transaction exits.
+        '''
+        self._txn_depth += 1
+        try:
+            yield
+        finally:
+            self._txn_depth -= 1
+            if self._txn_depth == 0 and self._txn_dirty:
+                self._txn_dirty = False
+                self.save_config()
 
 
     def get_bucket(self,bucket_name):
         '''
         Retrieve a bucket object by its name.  Raise an error if the bucket does not exist.
         '''
-        try:
-            ind = self.bucket_names.index(bucket_name)
-        except ValueError:
+        ind = self._bucket_index.get(bucket_name)
+        if ind is None:
             raise ValueError('Bucket with name: %s does not exist!' % bucket_name)
 
         bucket = self.buckets[ind]
@@ -127,7 +280,7 @@ class Resen():
         Create "empty" bucket.  Only name assigned.
         '''
         # raise error if bucket_name already in uses
-        if bucket_name in self.bucket_names:
+        if bucket_name in self._bucket_index:
             raise ValueError("Bucket with name: %s already exists!" % (bucket_name))
 
         params = dict()
@@ -143,7 +296,7 @@ class Resen():
 
         # now add the new bucket to the self.buckets config and then update the config file
         self.buckets.append(params)
-        self.bucket_names = [x['name'] for x in self.buckets]
+        self._bucket_index[bucket_name] = len(self.buckets)-1
         self.save_config()
 
         return
@@ -154,45 +307,51 @@ class Resen():
         Remove a bucket, including the corresponding container.
         '''
 
-        self.update_bucket_statuses()
-        bucket = self.get_bucket(bucket_name)
-
-        # cannot remove bucket if currently running - raise error
-        if bucket['status'] == 'running':
-            raise RuntimeError('ERROR: Bucket %s is running, cannot remove.' % (bucket['name']))
-
-        # are other buckets using the same image?
-        # if so, we shouldn't try to remove the image!
-        rm_image_id = bucket['image']['image_id']
-        buckets_with_same_id = list()
-        for x in self.buckets:
-            other_id = x['image']['image_id']
-            other_name = x['name']
-            if other_id == rm_image_id and other_name != bucket_name:
-                buckets_with_same_id.append(other_name)
-
-        remove_image = len(buckets_with_same_id) == 0
-
-        # if docker container created, remove it first and update status
-        if bucket['status'] in ['created','exited'] and bucket['container'] is not None:
-            # if bucket imported, clean up by removing image and import directory
-            if 'import_dir' in bucket:
-                self.dockerhelper.remove_container(bucket, remove_image=remove_image)
-                # also remove temporary import directory
-                shutil.rmtree(bucket['import_dir'])
-            else:
-                self.dockerhelper.remove_container(bucket)
-
-            bucket['status'] = None
-            bucket['container'] = None
+        # batch the intermediate save_config calls into a single write
+        with self._config_transaction():
+            bucket = self.get_bucket(bucket_name)
+            self._refresh_bucket_status(bucket)
+
+            # cannot remove bucket if currently running - raise error
+            if bucket['status'] == 'running':
+                raise RuntimeError('ERROR: Bucket %s is running, cannot remove.' % (bucket['name']))
+
+            # are other buckets using the same image?
+            # if so, we shouldn't try to remove the image!
+            rm_image_id = bucket['image']['image_id']
+            buckets_with_same_id = list()
+            for x in self.buckets:
+                other_id = x['image']['image_id']
+                other_name = x['name']
+                if other_id == rm_image_id and other_name != bucket_name:
+                    buckets_with_same_id.append(other_name)
+
+            remove_image = len(buckets_with_same_id) == 0
+
+            # if docker container created, remove it first and update status
+            if bucket['status'] in ['created','exited'] and bucket['container'] is not None:
+                # if bucket imported, clean up by removing image and import directory
+                if 'import_dir' in bucket:
+                    self.dockerhelper.remove_container(bucket, remove_image=remove_image)
+                    # also remove temporary import directory
+                    shutil.rmtree(bucket['import_dir'])
+                else:
+                    self.dockerhelper.remove_container(bucket)
+
+                self._status_cache.pop(bucket['container'], None)
+                bucket['status'] = None
+                bucket['container'] = None
+                self.save_config()
+
+            # remove bucket from the bucket list and shift the index entries after it
+            ind = self._bucket_index.pop(bucket_name)
+            self.buckets.pop(ind)
+            for name, i in self._bucket_index.items():
+                if i > ind:
+                    self._bucket_index[name] = i-1
+            self._assigned_ports = {y[0] for x in self.buckets for y in x['port']}
             self.save_config()
 
-        # identify bucket index and remove it from both buckets and bucket_names
-        ind = self.bucket_names.index(bucket_name)
-        self.buckets.pop(ind)
-        self.bucket_names.pop(ind)
-        self.save_config()
-
         return
 
 
@@ -212,12 +371,11 @@ class Resen():
             raise RuntimeError("Bucket has already been started, cannot set new image.")
 
         # check that input is a valid image
-        valid_versions = [x['version'] for x in self.valid_cores]
-        if not docker_image in valid_versions:
-            raise ValueError("Invalid resen-core version %s. Valid versions: %s" % (docker_image,', '.join(valid_versions)))
+        image = self._valid_cores_by_version.get(docker_image)
+        if image is None:
+            valid_versions = ', '.join(x['version'] for x in self.valid_cores)
+            raise ValueError("Invalid resen-core version %s. Valid versions: %s" % (docker_image,valid_versions))
 
-        ind = valid_versions.index(docker_image)
-        image = self.valid_cores[ind]
         bucket['image'] = image
 
         self.save_config()
@@ -240,7 +398,7 @@ class Resen():
             raise RuntimeError("Bucket has already been started, cannot add storage: %s" % (local))
 
         # check that local file path exists
-        if not Path(local).is_dir():
+        if not os.path.isdir(local):
             raise FileNotFoundError('Cannot find local storage location!')
 
         # if docker toolbox, change path to be the docker VM path instead of the host machine path
@@ -248,28 +406,24 @@ class Resen():
             local = Path(local.replace(self.win_vbox_map[0],self.win_vbox_map[1])).as_posix()
 
         # check if input locations already exist in bucket list of storage
-        existing_local = [x[0] for x in bucket['storage']]
-        if local in existing_local:
+        if any(x[0] == local for x in bucket['storage']):
             raise FileExistsError('Local storage location already in use in bucket!')
-        existing_container = [x[1] for x in bucket['storage']]
-        if container in existing_container:
+        if any(x[1] == container for x in bucket['storage']):
             raise FileExistsError('Container storage location already in use in bucket!')
 
         # check that user is mounting in a whitelisted location
-        valid = False
-        child = Path(container)
-        for loc in self.storage_whitelist:
-            p = Path(loc)
-            if p == child or p in child.parents:
-                valid = True
+        # container paths are posix, so a normalized prefix comparison is
+        # equivalent to (and much cheaper than) walking Path.parents
+        child = posixpath.normpath(container)
+        valid = any(child == base or child.startswith(base+'/') for base in self._whitelist_prefixes)
         if not valid:
             raise ValueError("Invalid mount location. Can only mount storage into: %s." % ', '.join(self.storage_whitelist))
 
         # check and adjust permissions
-        if not permissions in ['r','ro','rw']:
+        if not permissions in _VALID_PERMS:
             raise ValueError("Invalid permissions. Valid options are 'r' and 'rw'.")
 
-        if permissions in ['r','ro']:
+        if permissions in _READONLY_PERMS:
             permissions = 'ro'
 
         if self.selinux:
@@ -299,11 +453,9 @@ class Resen():
             local = Path(local.replace(self.win_vbox_map[0],self.win_vbox_map[1])).as_posix()
 
         # find index of storage
-        existing_storage = [x[0] for x in bucket['storage']]
-        try:
-            ind = existing_storage.index(local)
+        ind = next((i for i,x in enumerate(bucket['storage']) if x[0] == local), None)
         # raise exception if input location does not exist
-        except ValueError:
+        if ind is None:
             raise FileNotFoundError("Storage location %s not associated with bucket %s" % (local,bucket_name))
 
         bucket['storage'].pop(ind)
@@ -330,14 +482,13 @@ class Resen():
 
         else:
             # check if local/container port already exists in list of ports
-            existing_local = [x[0] for x in bucket['port']]
-            if local in existing_local:
+            if any(x[0] == local for x in bucket['port']):
                 raise ValueError('Local port location already in use in bucket!')
-            existing_container = [x[1] for x in bucket['port']]
-            if container in existing_container:
+            if any(x[1] == container for x in bucket['port']):
                 raise ValueError('Container port location already in use in bucket!')
 
         bucket['port'].append([local,container,tcp])
+        self._assigned_ports.add(local)
         self.save_config()
 
         return
@@ -355,14 +506,14 @@ class Resen():
             raise RuntimeError("Bucket has already been started, cannot remove port: %s" % (local))
 
         # find port and remove it
-        existing_port = [x[0] for x in bucket['port']]
-        try:
-            ind = existing_port.index(local)
+        ind = next((i for i,x in enumerate(bucket['port']) if x[0] == local), None)
         # raise exception if port is not assigned to bucket
-        except ValueError:
+        if ind is None:
             raise ValueError("Port location %s not associated with bucket %s" % (local,bucket_name))
 
         bucket['port'].pop(ind)
+        # rebuild rather than discard - another bucket may use the same local port
+        self._assigned_ports = {y[0] for x in self.buckets for y in x['port']}
         self.save_config()
 
         return
@@ -373,21 +524,20 @@ class Resen():
         # TODO: check if port location exists on host - maybe not?  If usuer manually assigns port, ok to trust they know what they're doing?
         # check if port avaiable on host (from https://stackoverflow.com/questions/2470971/fast-way-to-test-if-a-port-is-in-use-using-python)
         port = 9000
-        assigned_ports = [y[0] for x in self.buckets for y in x['port']]
 
         while True:
-            if port in assigned_ports:
+            if port in self._assigned_ports:
                 port += 1
                 continue
 
+            # a successful bind means the port is free; SO_REUSEADDR is NOT
+            # set so ports in TIME_WAIT are correctly reported as busy
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
                 try:
                     s.bind(('localhost', port))
-                    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
                     return port
-                except Exception as e:
-                    print(port, str(e))
-                    port +=1
+                except OSError:
+                    port += 1
 
 
     def create_container(self, bucket_name, give_sudo=True):
@@ -429,6 +579,7 @@ class Resen():
 
         # start the container and update status
         status = self.dockerhelper.start_container(bucket)
+        self._status_cache.pop(bucket['container'], None)
         bucket['status'] = status
         self.save_config()
 
@@ -444,9 +595,9 @@ class Resen():
         Stop bucket
         '''
 
-        self.update_bucket_statuses()
         # get bucket
         bucket = self.get_bucket(bucket_name)
+        self._refresh_bucket_status(bucket)
 
         # if bucket is already stopped, do nothing
         if bucket['status'] in ['created', 'exited']:
@@ -454,6 +605,7 @@ class Resen():
 
         # stop the container and update status
         status = self.dockerhelper.stop_container(bucket)
+        self._status_cache.pop(bucket['container'], None)
         bucket['status'] = status
         self.save_config()
 
@@ -467,9 +619,9 @@ class Resen():
         '''
         Execute a command in the bucket.  Returns the exit code and output form the command, if applicable (if not detached?).
         '''
-        self.update_bucket_statuses()
         # get bucket
         bucket = self.get_bucket(bucket_name)
+        self._refresh_bucket_status(bucket)
 
         # raise error if bucket not running
         if bucket['status'] not in ['running']:
@@ -525,17 +677,23 @@ class Resen():
         envpath = bucket['image'].get('envpath','/home/jovyan/envs/py36')
 
         # set a random token and form
-        token = '%048x' % random.randrange(16**48)
+        token = secrets.token_hex(24)
         command = "bash -cl 'source %s/bin/activate && jupyter lab --no-browser --ip 0.0.0.0 --port %s --NotebookApp.token=%s --KernelSpecManager.ensure_native_kernel=False'"
         command = command % (envpath,container_port, token)
 
         # exectute command to start jupyter server
         self.execute_command(bucket_name,command,detach=True)
-        time.sleep(0.1)
 
-        # now check that jupyter is running
-        self.update_bucket_statuses()
-        pid = self.get_jupyter_pid(bucket_name)
+        # now check that jupyter is running - poll with short sleeps instead of
+        # waiting a fixed amount, so a fast server start returns quickly
+        self._refresh_bucket_status(bucket)
+        pid = None
+        deadline = time.monotonic() + 2.0
+        while time.monotonic() < deadline:
+            pid = self.get_jupyter_pid(bucket_name)
+            if pid is not None:
+                break
+            time.sleep(0.05)
 
         if pid is None:
             raise RuntimeError("Failed to start jupyter server!")
@@ -548,7 +706,17 @@ class Resen():
         # print url to access jupyter lab to screen and automatically open in web browser
         url = 'http://localhost:%s/?token=%s' % (local_port,token)
         print("Jupyter lab can be accessed in a browser at: %s" % (url))
-        time.sleep(3)
+
+        # wait until the server actually accepts connections before opening
+        # the browser - exits as soon as jupyter is listening rather than
+        # padding with a fixed sleep
+        deadline = time.monotonic() + 10.0
+        while time.monotonic() < deadline:
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                s.settimeout(0.5)
+                if s.connect_ex(('127.0.0.1', int(local_port))) == 0:
+                    break
+            time.sleep(0.05)
         webbrowser.open(url)
 
         return
@@ -594,17 +762,23 @@ class Resen():
         '''
         Get PID for the jupyter server running in a particular bucket
         '''
-        code, output = self.execute_command(bucket_name, 'ps -ef', detach=False)
-        output = output.decode('utf-8').split('\n')
+        # pgrep filters the process table inside the container (in C), so only
+        # the matching line crosses the docker exec pipe instead of the full
+        # ps -ef output.  '|| true' keeps the exit code 0 when no server is
+        # running, since execute_command raises on non-zero exit.
+        command = "sh -c \"pgrep -af 'jupyter[- ]lab .*--no-browser --ip 0.0.0.0' || true\""
+        code, output = self.execute_command(bucket_name, command, detach=False)
 
-        pid = None
-        for line in output:
-            if ('jupyter-lab' in line or 'jupyter lab' in line) and '--no-browser --ip 0.0.0.0' in line:
-                parsed_line = [x for x in line.split(' ') if x != '']
-                pid = parsed_line[1]
-                break
+        # pgrep -a output is 'PID full-command-line', but exec_run merges
+        # stderr into stdout, so only accept a line that starts with a PID -
+        # stderr noise (e.g. pgrep missing from the container) must map to
+        # "no server found", not get returned as a bogus pid
+        for line in output.decode('utf-8','replace').splitlines():
+            fields = line.split(None, 1)
+            if fields and fields[0].isdigit():
+                return fields[0]
 
-        return pid
+        return None
 
 
     def export_bucket(self, bucket_name, outfile, exclude_mounts=[], img_repo=None, img_tag=None):
@@ -644,39 +818,60 @@ class Resen():
             if not img_tag:
                 img_tag = 'latest'
 
-            # export container to image *.tar file
-            image_file_name = '{}_image.tgz'.format(bucket_name)
-            print('...exporting image...')
-            status = self.dockerhelper.export_container(bucket, bucket_dir_path.joinpath(image_file_name), img_repo, img_tag)
-            print('...done')
-            manifest['image'] = image_file_name
-            manifest['image_repo'] = img_repo
-            manifest['image_tag'] = img_tag
-
-            # save all mounts individually as *.tgz files
-            manifest['mounts'] = list()
-            for mount in bucket['storage']:
-                # skip mount if it is listed in exclude_mounts
-                if mount[0] in exclude_mounts:
-                    continue
-
-                source_dir = Path(mount[0])
-                mount_file_name = '{}_mount.tgz'.format(source_dir.name)
-                print('...exporting mount: %s' % str(source_dir))
-                with tarfile.open(str(bucket_dir_path.joinpath(mount_file_name)), "w:gz", compresslevel=1) as tar:
-                    tar.add(str(source_dir), arcname=source_dir.name)
-
-                manifest['mounts'].append([mount_file_name, mount[1], mount[2]])
-
-            # save manifest file
-            print('...saving manifest')
-            with open(str(bucket_dir_path.joinpath('manifest.json')),'w') as f:
-                json.dump(manifest, f)
-
-            # save entire bucket as tar file
+            # add each artifact to the output tar file as soon as it is
+            # created and remove the temporary copy immediately, so peak disk
+            # usage is one artifact rather than a full second copy of the bucket
             with tarfile.open(outfile, 'w') as tar:
-                for f in os.listdir(str(bucket_dir_path)):
-                    tar.add(str(bucket_dir_path.joinpath(f)), arcname=f)
+
+                # export container to image *.tar file
+                image_file_name = '{}_image.tgz'.format(bucket_name)
+                image_file = bucket_dir_path.joinpath(image_file_name)
+                print('...exporting image...')
+                status = self.dockerhelper.export_container(bucket, image_file, img_repo, img_tag)
+                print('...done')
+                tar.add(str(image_file), arcname=image_file_name)
+                os.remove(str(image_file))
+                manifest['image'] = image_file_name
+                manifest['image_repo'] = img_repo
+                manifest['image_tag'] = img_tag
+
+                # save all mounts individually as *.tgz files
+                # compress mounts in parallel - zlib releases the GIL while
+                # compressing, so threads use multiple cores
+                mounts = [x for x in bucket['storage'] if x[0] not in exclude_mounts]
+
+                def pack_mount(mount):
+                    source_dir = Path(mount[0])
+                    mount_file_name = '{}_mount.tgz'.format(source_dir.name)
+                    print('...exporting mount: %s' % str(source_dir))
+                    with tarfile.open(str(bucket_dir_path.joinpath(mount_file_name)), "w:gz", compresslevel=1) as mtar:
+                        mtar.add(str(source_dir), arcname=source_dir.name, filter=_export_filter)
+                    return mount_file_name
+
+                # add each mount archive to the output tar and delete it as
+                # soon as its compression finishes, so peak temp disk usage
+                # stays at the in-flight archives rather than all of them
+                mount_file_names = [None]*len(mounts)
+                with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+                    futures = {executor.submit(pack_mount, mount):i for i,mount in enumerate(mounts)}
+                    for future in as_completed(futures):
+                        mount_file_name = future.result()
+                        mount_file_names[futures[future]] = mount_file_name
+                        mount_file = bucket_dir_path.joinpath(mount_file_name)
+                        tar.add(str(mount_file), arcname=mount_file_name)
+                        os.remove(str(mount_file))
+
+                # manifest entries keep the original mount order
+                manifest['mounts'] = list()
+                for mount, mount_file_name in zip(mounts, mount_file_names):
+                    manifest['mounts'].append([mount_file_name, mount[1], mount[2]])
+
+                # save manifest file
+                print('...saving manifest')
+                manifest_file = bucket_dir_path.joinpath('manifest.json')
+                with open(str(manifest_file),'w') as f:
+                    json.dump(manifest, f)
+                tar.add(str(manifest_file), arcname='manifest.json')
 
         print('...Bucket export complete!')
 
@@ -710,37 +905,43 @@ class Resen():
         with open(str(extract_dir.joinpath('manifest.json')),'r') as f:
             manifest = json.load(f)
 
-        # create new bucket
-        self.create_bucket(bucket_name)
-        bucket = self.get_bucket(bucket_name)
-
-        if not img_repo:
-            img_repo = manifest['image_repo']
-        full_repo = 'earthcubeingeo/{}'.format(img_repo)
-
-        if not img_tag:
-            img_tag = manifest['image_tag']
-
-        # load image
-        image_file = str(extract_dir.joinpath(manifest['image']))
-        img_id = self.dockerhelper.import_image(image_file,full_repo,img_tag)
-
-        # add image to bucket
-        bucket['image'] = {"version":img_tag,"repo":img_repo,"org":"earthcubeingeo","image_id":img_id,"repodigest":''}
+        # batch the save_config calls from create_bucket/add_storage into one write
+        with self._config_transaction():
+            # create new bucket
+            self.create_bucket(bucket_name)
+            bucket = self.get_bucket(bucket_name)
 
-        # add mounts to bucket
-        for mount in manifest['mounts']:
-            # extract mount from tar file
-            with tarfile.open(str(extract_dir.joinpath(mount[0]))) as tar:
-                tar.extractall(path=str(extract_dir))
-                local = extract_dir.joinpath(tar.getnames()[0])
-            # remove mount tar file
-            os.remove(str(extract_dir.joinpath(mount[0])))
-            # add mount to bucket with original container path
-            self.add_storage(bucket_name,str(local),mount[1],permissions=mount[2])
+            if not img_repo:
+                img_repo = manifest['image_repo']
+            full_repo = 'earthcubeingeo/{}'.format(img_repo)
 
-        bucket['import_dir'] = str(extract_dir)
-        self.save_config()
+            if not img_tag:
+                img_tag = manifest['image_tag']
+
+            # load image
+            image_file = str(extract_dir.joinpath(manifest['image']))
+            img_id = self.dockerhelper.import_image(image_file,full_repo,img_tag)
+
+            # add image to bucket
+            bucket['image'] = {"version":img_tag,"repo":img_repo,"org":"earthcubeingeo","image_id":img_id,"repodigest":''}
+
+            # add mounts to bucket
+            for mount in manifest['mounts']:
+                # extract mount from tar file - extractall is kept because it
+                # defers directory permissions until every member is written
+                # (a per-member extract loop fails on read-only directories),
+                # and it fills the member cache, so getmembers() afterwards
+                # does not re-scan the archive index
+                with tarfile.open(str(extract_dir.joinpath(mount[0]))) as tar:
+                    tar.extractall(path=str(extract_dir))
+                    local = extract_dir.joinpath(tar.getmembers()[0].name.split('/',1)[0])
+                # remove mount tar file
+                os.remove(str(extract_dir.joinpath(mount[0])))
+                # add mount to bucket with original container path
+                self.add_storage(bucket_name,str(local),mount[1],permissions=mount[2])
+
+            bucket['import_dir'] = str(extract_dir)
+            self.save_config()
 
         # clean up image file
         if remove_image_file:
@@ -790,18 +991,20 @@ class Resen():
         Generate a nicely formated string listing all the buckets and their statuses
         '''
         if bucket_name is None:
+            # accumulate the table and write it to stdout in one call instead
+            # of issuing a print per bucket
             if names_only:
-                print("{:<0}".format("Bucket Name"))
+                lines = ["{:<0}".format("Bucket Name")]
                 for name in self.bucket_names:
-                    print("{:<0}".format(str(name)))
+                    lines.append("{:<0}".format(str(name)))
             else:
-
-                print("{:<20}{:<25}{:<25}".format("Bucket Name","Version","Status"))
+                lines = ["{:<20}{:<25}{:<25}".format("Bucket Name","Version","Status")]
                 for bucket in self.buckets:
-                    name = self.__trim(str(bucket['name']),18)
-                    image = self.__trim(str(bucket['image']['version']),23)
-                    status = self.__trim(str(bucket['status']),23)
-                    print("{:<20}{:<25}{:<25}".format(name, image, status))
+                    name = _trim(str(bucket['name']),18)
+                    image = _trim(str(bucket['image']['version']),23)
+                    status = _trim(str(bucket['status']),23)
+                    lines.append("{:<20}{:<25}{:<25}".format(name, image, status))
+            sys.stdout.write('\n'.join(lines)+'\n')
 
         else:
             bucket = self.get_bucket(bucket_name)
@@ -827,29 +1030,87 @@ class Resen():
         return
 
 
-    def update_bucket_statuses(self):
+    def update_bucket_statuses(self, force=False):
         '''
-        Update container status for all buckets
+        Update container status for all buckets.  Refreshes at most once every
+        0.5 s unless force is set, so back-to-back calls within one user
+        command don't repeat the docker round-trip.
         '''
+        if not force and time.monotonic() - self._statuses_refreshed < 0.5:
+            return
+        self._statuses_refreshed = time.monotonic()
+
+        container_ids = [x['container'] for x in self.buckets if x['container'] is not None]
+        if not container_ids:
+            return
+
+        # query all containers with a single docker API call
+        statuses = self.dockerhelper.get_container_statuses(container_ids)
+        now = time.monotonic()
+
+        # only save the config once at the end, and only if a status changed
+        dirty = False
         for bucket in self.buckets:
-            if bucket['container'] is None:
+            container_id = bucket['container']
+            if container_id is None:
                 continue
 
-            status = self.dockerhelper.get_container_status(bucket)
+            # leave the status unchanged if docker did not report the container
+            status = statuses.get(container_id, bucket['status'])
+            self._status_cache[container_id] = (status, now)
+            if status != bucket['status']:
+                bucket['status'] = status
+                dirty = True
+
+        if dirty:
+            self.save_config()
+
+
+    def _refresh_bucket_status(self,bucket):
+        '''
+        Update the container status for a single bucket, rather than querying
+        docker about every bucket.
+        '''
+        if bucket['container'] is None:
+            return
+
+        status = self._get_container_status(bucket)
+        if status != bucket['status']:
             bucket['status'] = status
             self.save_config()
 
 
+    def _get_container_status(self,bucket):
+        '''
+        Get the container status for a bucket, caching results briefly so that
+        repeated queries within a single command don't each hit the docker daemon.
+        '''
+        container_id = bucket['container']
+        now = time.monotonic()
+        cached = self._status_cache.get(container_id)
+        if cached is not None and now - cached[1] < 0.5:
+            return cached[0]
+
+        status = self.dockerhelper.get_container_status(bucket)
+        self._status_cache[container_id] = (status, now)
+        return status
+
+
     def update_core_list(self):
 
         core_list_url = 'https://raw.githubusercontent.com/EarthCubeInGeo/resen-core/master/cores.json'
         core_filename = os.path.join(self.resen_root_dir,'cores','cores.json')
 
         r = requests.get(core_list_url)
-        with open(core_filename, 'wb') as f:
+        # write atomically so a background refresh can never leave a
+        # partially-written cores.json behind
+        tmp_filename = core_filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
             f.write(r.content)
+        os.replace(tmp_filename, core_filename)
 
         self.valid_cores = self.__get_valid_cores()
+        self._valid_cores_by_version = {x['version']:x for x in self.valid_cores}
 
 
     def __get_valid_cores(self):
@@ -860,10 +1121,23 @@ class Resen():
         if not os.path.exists(core_dir):
             os.makedirs(core_dir)
             self.update_core_list()
+        else:
+            self.__refresh_core_list_if_stale(os.path.join(core_dir,'cores.json'))
 
         # for each JSON file in core directory, read in list of cores
         cores = []
         for fn in os.listdir(core_dir):
+            # remove temp files left behind if a (possibly background)
+            # core list download died mid-write, and never parse them -
+            # a complete leftover would silently duplicate every core
+            if fn.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(core_dir,fn))
+                except OSError:
+                    pass
+                continue
+            if not fn.endswith('.json'):
+                continue
             try:
                 with open(os.path.join(core_dir,fn),'r') as f:
                     cores.extend(json.load(f))
@@ -872,22 +1146,33 @@ class Resen():
 
         return cores
 
-    def _get_config_dir(self):
-        appname = 'resen'
 
-        if 'APPDATA' in os.environ:
-            confighome = os.environ['APPDATA']
-        elif 'XDG_CONFIG_HOME' in os.environ:
-            confighome = os.environ['XDG_CONFIG_HOME']
-        else:
-            confighome = os.path.join(os.environ['HOME'],'.config')
-        configpath = os.path.join(confighome, appname)
+    def __refresh_core_list_if_stale(self, core_filename, max_age=86400.):
+        '''
+        Re-download the core list in the background if the cached copy is more
+        than a day old.  The stale list is used in the meantime, so startup
+        never waits on the network.
+        '''
+        try:
+            age = time.time() - os.path.getmtime(core_filename)
+        except OSError:
+            age = None
+
+        if age is not None and age < max_age:
+            return
 
-        # TODO: add error checking
-        if not os.path.exists(configpath):
-            os.makedirs(configpath)
+        def refresh():
+            try:
+                self.update_core_list()
+            except Exception:
+                # no network or a bad download - keep using the cached list
+                pass
 
-        return configpath
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+    def _get_config_dir(self):
+        return _get_config_dir()
 
 
     def _get_home_dir(self):
@@ -897,46 +1182,23 @@ class Resen():
         return os.path.join(homedir,appname)
 
 
-    def __process_exists(self,pid):
-        # Need to do different things for *nix vs. Windows
-        # see https://stackoverflow.com/questions/568271/how-to-check-if-there-exists-a-process-with-a-given-pid-in-python
+    def __lock(self):
+        # take an OS-level advisory lock on the lockfile: a single syscall,
+        # race-free, and automatically released by the kernel if the process
+        # dies, so no stale lockfiles are left behind after a crash
+        self.__lockfd = os.open(self.__lockfile, os.O_RDWR | os.O_CREAT, 0o644)
 
-        if os.name == 'nt':
-            # only works on windows
-            from win32com.client import GetObject
-            WMI = GetObject('winmgmts:')
-            processes = WMI.InstancesOf('Win32_Process')
-            pids = [process.Properties_('ProcessID').Value for process in processes]
-            return pid in pids
-        else:
-            # only works on *nix systems
-            try:
-                os.kill(pid,0)
-            except ProcessLookupError:
-                return False
-            except PermissionError: # errno.EPERM
-                return True # Operation not permitted (i.e., process exists)
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                msvcrt.locking(self.__lockfd, msvcrt.LK_NBLCK, 1)
             else:
-                return True # no error, we can send a signal to the process
+                import fcntl
+                fcntl.flock(self.__lockfd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(self.__lockfd)
+            raise RuntimeError('Another instance of Resen is already running!')
 
-
-    def __lock(self):
-        # dev note: if we want to be more advanced, need psutil as dependency
-        # get some telemetry to fingerprint with
-        cur_pid = os.getpid()      # process id
-
-        # check if lockfile exists
-        self.__lockfile = os.path.join(self.resen_root_dir,'lock')
-        if os.path.exists(self.__lockfile):
-            #parse existing file
-            with open(self.__lockfile,'r') as f:
-                pid = int(f.read())
-                if self.__process_exists(pid):
-                    raise RuntimeError('Another instance of Resen is already running!')
-
-        telem = '%d' % (cur_pid)
-        with open(self.__lockfile,'w') as f:
-            f.write(telem)
         self.__locked = True
 
 
@@ -945,27 +1207,12 @@ class Resen():
             return
 
         try:
-            os.remove(self.__lockfile)
+            # closing the file descriptor drops the advisory lock
+            os.close(self.__lockfd)
             self.__locked = False
-        except FileNotFoundError:
-            pass
         except Exception as e:
-            print("WARNING: Unable to remove lockfile: %s" % str(e))
-
+            print("WARNING: Unable to release lock: %s" % str(e))
 
-    def __detect_selinux(self):
-        try:
-            p = Popen(['/usr/sbin/getenforce'], stdin=PIPE, stdout=PIPE, stderr=PIPE)
-            output, err = p.communicate()
-            output = output.decode('utf-8').strip('\n')
-            rc = p.returncode
-
-            if rc == 0 and output == 'Enforcing':
-                return True
-            else:
-                return False
-        except FileNotFoundError:
-            return False
 
     def __get_win_vbox_map(self):
         # quick fix for determining windows with docker tool box
@@ -981,14 +1228,11 @@ class Resen():
 
 
 
-    def __trim(self,string,length):
-        if len(string) > length:
-            return string[:length-3]+'...'
-        else:
-            return string
+    def __enter__(self):
+        return self
 
 
-    def __del__(self):
+    def __exit__(self, *exc):
         self.__unlock()
 
 